@@ -15,8 +15,8 @@ setup(
         "paddleocr==2.7.3",
         "paddlepaddle==2.6.1",
         "boto3==1.26.106",
-        "html2excel==0.0.6",
-        "aiofiles==23.2.1"
+        "lxml==4.9.3",
+        "openpyxl==3.1.2"
         ],
 
     author="Ranjan Shrestha",
@@ -1,21 +1,28 @@
 import os
+import gc
+import copy
 import logging
 import re
-import random
+import asyncio
+import hashlib
+import threading
+from collections import deque, OrderedDict
+from multiprocessing import shared_memory, resource_tracker
 from pathlib import Path, PosixPath
 from enum import Enum
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Tuple, Generator, Optional
 from PIL import Image
 
+import cv2
 import fitz
 import numpy as np
-import aiofiles
+import paddle
 from paddleocr import PPStructure
-from html2excel import ExcelParser
 from ocr_extractor.storage import StorageHandler
-from ocr_extractor.utils import get_ocr_models
+from ocr_extractor.utils import get_ocr_models, html_table_to_excel
 
-logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
 
 class ExtractionType(Enum):
     """ Content Types Extraction from documents / images """
@@ -25,48 +32,262 @@ class ExtractionType(Enum):
     IMAGE_AND_TABLE = 4
 
 
+IMAGE_EXTENSION_RE = re.compile(r"\.(jpg|png|jpeg|gif)$", re.IGNORECASE)
+
+# Layout region types that each extraction type makes use of
+EXTRACTED_REGION_TYPES = {
+    ExtractionType.TEXT_ONLY.value: ["text", "figure"],
+    ExtractionType.TABLE_ONLY.value: ["table"],
+    ExtractionType.TEXT_AND_TABLE.value: ["text", "figure", "table"],
+    ExtractionType.IMAGE_AND_TABLE.value: ["text", "figure", "table"]
+}
+
+# PPStructure engines shared by the processors with the same configuration, as
+# [engine, lock guarding it, number of processors using it, event set once built];
+# loading the models takes tens of seconds
+_ocr_engines = {}
+_ocr_engines_lock = threading.Lock()
+
+
+def build_ocr_engine(engine_params: dict) -> PPStructure:
+    """
+    Build the PPStructure engine. int8 only applies to the (quantized) recognizer: the other
+    predictors have no int8 calibration and run in fp16
+    """
+    if engine_params.get("precision") != "int8":
+        return PPStructure(**engine_params)
+
+    ocr_engine = PPStructure(**{**engine_params, "precision": "fp16"})
+    systems = [
+        system for system in (ocr_engine.text_system, ocr_engine.table_system) if system is not None
+    ]
+    if systems:
+        rec_args = copy.copy(systems[0].args)
+        rec_args.precision = "int8"
+        # The table system shares the recognizer of the text system
+        text_recognizer = type(systems[0].text_recognizer)(rec_args)
+        for system in systems:
+            system.text_recognizer = text_recognizer
+    return ocr_engine
+
+
+def get_ocr_engine(engine_params: dict) -> Tuple[PPStructure, threading.Lock, bool]:
+    """
+    Returns the OCR engine of the configuration and its lock, building it on first use;
+    the flag tells whether the engine was just built
+    """
+    engine_key = tuple(sorted(engine_params.items()))
+    while True:
+        with _ocr_engines_lock:
+            entry = _ocr_engines.get(engine_key)
+            built = entry is None
+            if built:
+                # Placeholder, so that the other processors wait for this build
+                entry = [None, threading.Lock(), 1, threading.Event()]
+                _ocr_engines[engine_key] = entry
+            elif entry[0] is not None:
+                entry[2] += 1
+                return entry[0], entry[1], False
+        if not built:
+            # Built by another processor; its engine is picked up once ready, or built anew if it failed
+            entry[3].wait()
+            continue
+
+        # Built without holding the lock of all the engines, the other configurations carry on
+        try:
+            ocr_engine = build_ocr_engine(engine_params)
+        except BaseException:
+            with _ocr_engines_lock:
+                del _ocr_engines[engine_key]
+            entry[3].set()
+            raise
+        with _ocr_engines_lock:
+            entry[0] = ocr_engine
+        entry[3].set()
+        return ocr_engine, entry[1], True
+
+
+def release_ocr_engine(engine_params: dict, ocr_engine: PPStructure, evict: bool=False):
+    """
+    Drop a processor's reference to the shared OCR engine. The engine leaves the cache once
+    no processor uses it, or right away on evict so that the next use rebuilds it.
+    An engine that already left the cache (rebuilt by another processor) is left alone
+    """
+    engine_key = tuple(sorted(engine_params.items()))
+    with _ocr_engines_lock:
+        entry = _ocr_engines.get(engine_key)
+        if entry is None or entry[0] is not ocr_engine:
+            return
+        entry[2] -= 1
+        if evict or entry[2] == 0:
+            del _ocr_engines[engine_key]
+
+
+_render_worker_pdf = None
+_render_worker_matrix = None
+_render_worker_annots = True
+
+
+def get_zoom_matrix(zoom: tuple) -> fitz.Matrix:
+    """ Returns the render matrix of the zoom, sharing MuPDF's identity matrix when unscaled """
+    if tuple(zoom) == (1, 1):
+        return fitz.Identity
+    return fitz.Matrix(*zoom)
+
+
+def init_render_worker(file_path: str, zoom: tuple=(2,2), annots: bool=True):
+    """ Open the pdf once per render worker process instead of once per page """
+    global _render_worker_pdf, _render_worker_matrix, _render_worker_annots
+    _render_worker_pdf = fitz.open(file_path)
+    _render_worker_matrix = get_zoom_matrix(zoom)
+    _render_worker_annots = annots
+
+
+def get_page_pixmap(
+    pdf_file: fitz.Document,
+    page_number: int,
+    mat: fitz.Matrix,
+    annots: bool=True
+) -> fitz.Pixmap:
+    """ Rasterize a single pdf page into an RGB pixmap, skipping the annotations if not needed """
+    return pdf_file[page_number].get_pixmap(
+        matrix=mat,
+        colorspace=fitz.csRGB,
+        alpha=False,
+        annots=annots
+    )
+
+
+def render_pdf_page(
+    pdf_file: fitz.Document,
+    page_number: int,
+    mat: fitz.Matrix,
+    annots: bool=True
+) -> np.ndarray:
+    """ Rasterize a single pdf page """
+    pm = get_page_pixmap(pdf_file, page_number, mat, annots)
+    # Single copy straight out of the pixmap buffer, no PIL round-trip
+    return np.frombuffer(pm.samples_mv, dtype=np.uint8).reshape(pm.height, pm.width, pm.n).copy()
+
+
+def render_worker_page(page_number: int) -> Tuple[str, tuple]:
+    """
+    Rasterize a page of the pdf opened by the render worker into shared memory,
+    so the page does not have to be pickled back to the parent process
+    """
+    pm = get_page_pixmap(
+        _render_worker_pdf, page_number, _render_worker_matrix, _render_worker_annots
+    )
+    samples = pm.samples_mv
+    shm = shared_memory.SharedMemory(create=True, size=max(1, samples.nbytes))
+    shm.buf[:samples.nbytes] = samples
+    shm.close()
+    # The parent unlinks the block once it has read the page; left registered, the worker's
+    # resource tracker would also try to unlink it at shutdown and warn about a leak
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm.name, (pm.height, pm.width, pm.n)
+
+
+def read_shared_page(shm_name: str, shape: tuple) -> np.ndarray:
+    """ Copy a page out of the shared memory block and release the block """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        page = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        image_data = page.copy()
+        del page
+        return image_data
+    finally:
+        shm.close()
+        shm.unlink()
+
+
 class OCRBase:
     """ OCR module for extracting texts and tables """
     def __init__(self):
         self.file_path = None
         self.is_image = True
         self.img_file_extension = None
-        self.image_data = None
-        self.pdf_pages = None
+        self.render_workers = 1
+        self.render_annotations = True
 
     def load_file(self, file_path: str, is_image: bool):
         """ Set the file path """
         self.file_path = file_path
         self.is_image = is_image
-        self.img_file_extension = re.search(
-            "(?i)\.(jpg|png|jpeg|gif)$",
-            file_path
-        )
+        self.img_file_extension = IMAGE_EXTENSION_RE.search(file_path)
 
     def read_image(self) -> Optional[np.ndarray]:
         """ Read the image / scanned doc """
-        logging.info("Reading the image")
+        logger.info("Reading the image")
         if os.path.isfile(self.file_path):
+            img = cv2.imread(self.file_path, cv2.IMREAD_COLOR)
+            if img is not None:
+                return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+            # Formats OpenCV cannot decode (e.g. gif)
             img = Image.open(self.file_path).convert('RGB')
             return np.array(img)
-        logging.warning("Cannot open the image file %s", self.file_path)
+        logger.warning("Cannot open the image file %s", self.file_path)
         return None
 
     def read_pdf_scanned_doc(self, zoom: tuple=(2,2)) -> Optional[Generator]:
         """ Read scanned pdf doc """
-        logging.info("Reading the pdf file")
+        logger.info("Reading the pdf file")
         if os.path.isfile(self.file_path):
+            if self.render_workers > 1:
+                yield from self.read_pdf_pages_parallel(zoom)
+                return
+            mat = get_zoom_matrix(zoom)
             with fitz.open(self.file_path) as pdf_file:
                 for pg in range(0, pdf_file.page_count):
-                    page = pdf_file[pg]
-                    mat = fitz.Matrix(*zoom)
-                    pm = page.get_pixmap(matrix=mat, alpha=False)
-                    img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
-                    yield pg, np.array(img)
+                    yield pg, render_pdf_page(pdf_file, pg, mat, self.render_annotations)
         else:
-            logging.warning("Cannot open the pdf file %s", self.file_path)
+            logger.warning("Cannot open the pdf file %s", self.file_path)
             return None
 
+    def read_pdf_pages_parallel(self, zoom: tuple=(2,2)) -> Generator:
+        """ Rasterize the pdf pages across worker processes, yielding them in order """
+        with fitz.open(self.file_path) as pdf_file:
+            page_count = pdf_file.page_count
+
+        # Only keep a couple of pages per worker in flight so memory stays bounded
+        max_pending = 2 * self.render_workers
+        with ProcessPoolExecutor(
+            max_workers=self.render_workers,
+            initializer=init_render_worker,
+            initargs=(self.file_path, zoom, self.render_annotations)
+        ) as executor:
+            pending = deque()
+            try:
+                for pg in range(0, page_count):
+                    pending.append((pg, executor.submit(render_worker_page, pg)))
+                    if len(pending) >= max_pending:
+                        page_num, future = pending.popleft()
+                        yield page_num, read_shared_page(*future.result())
+                while pending:
+                    page_num, future = pending.popleft()
+                    yield page_num, read_shared_page(*future.result())
+            finally:
+                # Free the blocks of the pages rendered but never consumed
+                for _, future in pending:
+                    if not future.cancel() and future.exception() is None:
+                        read_shared_page(*future.result())
+
+    def produce_pdf_pages(
+        self,
+        page_queue: asyncio.Queue,
+        loop: asyncio.AbstractEventLoop,
+        stop_event: threading.Event
+    ):
+        """ Rasterize the pdf pages into the event loop's queue; None marks the end """
+        try:
+            for item in self.read_pdf_scanned_doc():
+                if stop_event.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(page_queue.put(item), loop).result()
+        finally:
+            if not stop_event.is_set():
+                asyncio.run_coroutine_threadsafe(page_queue.put(None), loop).result()
+
     def get_dims(self, img: np.ndarray) -> Tuple[float, float]:
         """ Returns the image dimensions """
         return img.shape[0], img.shape[1]
@@ -87,6 +308,20 @@ class OCRProcessor(OCRBase):
         process_table: bool=True,
         aws_region_name: str="us-east-1",
         models_base_path: PosixPath=Path("/ocr/models"),
+        render_workers: int=1,
+        render_annotations: bool=True,
+        warmup: bool=False,
+        cpu_threads: int=10,
+        rec_batch_num: int=6,
+        use_tensorrt: bool=False,
+        enable_mkldnn: bool=False,
+        line_threshold: int=10,
+        use_cache: bool=True,
+        cache_size: int=8,
+        max_long_side: int=None,
+        reinit_every: int=0,
+        png_compression: int=1,
+        trust_existing_models: bool=False,
         **kwargs
     ) -> None:
         """
@@ -94,6 +329,8 @@ class OCRProcessor(OCRBase):
 
         file_path: Path of the input file
         lang: The language in which the document is written
+        precision: Inference precision of the models (fp32, fp16 or int8). int8 applies to the recognizer only,
+            which is swapped for the quantized one; the other models run in fp16
         is_image: Type of the document
         extraction_type: Either extract text only or table only or both
         show_log: Whether to display the OCR config logs
@@ -104,10 +341,33 @@ class OCRProcessor(OCRBase):
         process_text: Whether to extract the texts from images / scans
         process_table: Whether to extract the tables from images / scans
         aws_region_name: The AWS region to be used.
+        render_workers: Number of processes used to rasterize the pdf pages (1 renders in-process)
+        render_annotations: Whether to draw the pdf annotations (stamps, comments, ...) on the pages
+        warmup: Whether to run the models once on a blank page so the first page is not slowed down
+        cpu_threads: Number of threads used by the Paddle predictors on cpu
+        rec_batch_num: Number of text lines recognized together in a single batch
+        use_tensorrt: Whether to run the models with TensorRT on gpu
+        enable_mkldnn: Whether to run the models with MKL-DNN (oneDNN) on cpu
+        line_threshold: Max vertical gap (in pixels) between regions read as a single line
+        use_cache: Whether to reuse the OCR results of identical pages
+        cache_size: Number of pages whose OCR results are kept in the cache
+        max_long_side: Pages with a longer side (in pixels) are downscaled to it before OCR
+        reinit_every: Rebuild the OCR engine after this many pages to bound its memory (0 never rebuilds)
+        png_compression: zlib compression level (0-9) of the stored png images
+        trust_existing_models: Use the models found in models_base_path without downloading them,
+            e.g. baked into an image or mounted read-only
         """
 
         super().__init__()
+        self.render_workers = render_workers or os.cpu_count()
+        self.render_annotations = render_annotations
         self.extraction_type = extraction_type
+        self.line_threshold = line_threshold
+        self.lang = lang
+        self.use_cache = use_cache
+        self.cache_size = cache_size
+        self.result_cache = OrderedDict()
+        self.max_long_side = max_long_side
 
         if self.extraction_type == ExtractionType.TEXT_ONLY.value:
             process_text = True
@@ -122,38 +382,157 @@ class OCRProcessor(OCRBase):
             process_text = True
             process_table = True
 
-        ocr_models = get_ocr_models(base_path=models_base_path)
-        self.ocr_engine = PPStructure(
+        ocr_models = get_ocr_models(
+            base_path=models_base_path,
+            quantized=precision == "int8",
+            trust_existing=trust_existing_models
+        )
+        self.engine_params = dict(
             show_log=show_log,
             precision=precision,
             table=process_table,
             ocr=process_text,
             lang=lang,
             layout=layout,
-            recovery=True,
+            # Recovery mode pastes every region on a blank page-sized canvas and runs the
+            # text detector on the whole canvas; without it only the region crop is scanned
+            recovery=False,
+            cpu_threads=cpu_threads,
+            rec_batch_num=rec_batch_num,
+            use_tensorrt=use_tensorrt,
+            enable_mkldnn=enable_mkldnn,
             **ocr_models
         )
+        self.ocr_engine, self.engine_lock, engine_built = get_ocr_engine(self.engine_params)
+        self.reinit_every = reinit_every
+        self.pages_processed = 0
+        # A shared engine that was already in use is warm
+        if warmup and engine_built:
+            # Paddle sets up its predictors lazily on the first call
+            with self.engine_lock:
+                self.ocr_engine(np.full((640, 640, 3), 255, dtype=np.uint8))
 
-        self.s3handler = StorageHandler(use_s3, s3_bucket_name, s3_bucket_key, aws_region_name)
+        self.s3handler = StorageHandler(
+            use_s3, s3_bucket_name, s3_bucket_key, aws_region_name, png_compression
+        )
+        # The uploads / disk writes of a page are independent of each other
+        self.upload_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("OCR_CONCURRENCY", os.cpu_count()))
+        )
 
         self.final_combined_results = {
             "text": [],
             "image": [],
             "table": []
         }
+        self.table_cache = {}
+
+    def reload_ocr_engine(self):
+        """ Rebuild the OCR engine, releasing the memory held by the previous one """
+        logger.info("Reloading the OCR engine after %s pages.", self.pages_processed)
+        # Evicted only if no other processor rebuilt it already; otherwise its rebuild is reused
+        release_ocr_engine(self.engine_params, self.ocr_engine, evict=True)
+        self.ocr_engine = None
+        gc.collect()
+        if paddle.device.is_compiled_with_cuda():
+            paddle.device.cuda.empty_cache()
+        self.ocr_engine, self.engine_lock, _ = get_ocr_engine(self.engine_params)
+
+    def run_ocr_engine_uncached(self, image_data: np.ndarray) -> list:
+        """ Run the OCR engine, rebuilding it every reinit_every pages """
+        # PPStructure is not thread safe and may be shared with other processors
+        with self.engine_lock:
+            results = self.ocr_engine(image_data)
+        self.pages_processed += 1
+        # Paddle's memory grows steadily over long runs
+        if self.reinit_every and self.pages_processed % self.reinit_every == 0:
+            self.reload_ocr_engine()
+        return results
+
+    def run_ocr_engine(self, image_data: np.ndarray) -> list:
+        """ Run the OCR engine, reusing the results of the pages seen recently """
+        if not self.use_cache:
+            return self.run_ocr_engine_uncached(image_data)
+
+        cache_key = (
+            self.lang,
+            self.extraction_type,
+            image_data.shape,
+            hashlib.sha256(image_data.data).hexdigest()
+        )
+        if cache_key in self.result_cache:
+            self.result_cache.move_to_end(cache_key)
+            return self.result_cache[cache_key]
+
+        # Only what process makes use of: the stored crops are copied out, otherwise the
+        # slices would keep PPStructure's copy of the whole page alive in the cache
+        stored_crop_types = ["table"]
+        if self.extraction_type == ExtractionType.IMAGE_AND_TABLE.value:
+            stored_crop_types.append("figure")
+        results = [
+            {
+                "type": x["type"],
+                "bbox": x["bbox"],
+                "res": x.get("res", []),
+                "img": x["img"].copy() if x["type"] in stored_crop_types else None
+            }
+            for x in self.run_ocr_engine_uncached(image_data)
+            if x["type"] in EXTRACTED_REGION_TYPES.get(self.extraction_type, [])
+        ]
+        self.result_cache[cache_key] = results
+        if len(self.result_cache) > self.cache_size:
+            self.result_cache.popitem(last=False)
+        return results
 
     async def process(self, image_data: np.ndarray, page_number: int=0):
-        """ Extracts the contents from images or scans """
+        """ Extracts the contents from images or scans, with the links of the stored images / tables """
+        await self.submit_page(image_data, page_number)
+        await self.resolve_links()
+
+    async def submit_page(self, image_data: np.ndarray, page_number: int=0):
+        """
+        Extracts the contents from images or scans. The images / tables are stored in the
+        background: their links are futures until resolve_links is awaited
+        """
 
         try:
-            results = self.ocr_engine(image_data)
+            # No-op for the rendered pages; avoids the slow paths of strided inputs
+            image_data = np.ascontiguousarray(image_data)
+            height, width = self.get_dims(image_data)
+            if self.max_long_side and max(height, width) > self.max_long_side:
+                # The detector / recognizer cost grows with the number of pixels
+                scale = self.max_long_side / max(height, width)
+                image_data = cv2.resize(
+                    image_data,
+                    (int(width * scale), int(height * scale)),
+                    interpolation=cv2.INTER_AREA
+                )
+            results = self.run_ocr_engine(image_data)
         except Exception as exc:
             # TODO handle exception
-            logging.error(f"Exception occurred {str(exc)}", exc_info=True)
+            logger.error("Exception occurred %s", exc, exc_info=True)
             return
 
         # Sort boxes based on y1 and x1 : bbox top left coordinates
-        sorted_results = sorted(results, key=lambda x: (x["bbox"][1], x["bbox"][0]))
+        height, width = self.get_dims(image_data)
+        boxes = np.array([x["bbox"] for x in results], dtype=np.int32).reshape(-1, 4)
+        types = np.array([x["type"] for x in results], dtype=str)
+        np.clip(boxes, 0, [width, height, width, height], out=boxes)
+        # Skip the regions lying outside of the page or of a type which is not extracted
+        keep = np.flatnonzero(
+            (boxes[:, 2] > boxes[:, 0]) &
+            (boxes[:, 3] > boxes[:, 1]) &
+            np.isin(types, EXTRACTED_REGION_TYPES.get(self.extraction_type, []))
+        )
+        if keep.size == 0:
+            return
+        xs, ys = boxes[keep, 0], boxes[keep, 1]
+        # Regions whose tops are less than line_threshold apart form a line, read left to right.
+        # The stable sort is linear on the (common) already-sorted input
+        y_order = np.argsort(ys, kind="stable")
+        line_ids = np.concatenate(([0], np.cumsum(np.diff(ys[y_order]) >= self.line_threshold)))
+        order = keep[y_order[np.lexsort((xs[y_order], line_ids))]]
+        sorted_results = [results[i] for i in order]
         text_sort_number = 0
         table_sort_number = 0
         extracted_images = []
@@ -164,13 +543,13 @@ class OCRProcessor(OCRBase):
                     ExtractionType.IMAGE_AND_TABLE.value
                 ]
             ):
-                image_link = self.s3handler.get_s3_link_or_local_path_for_image(
+                extracted_images.append(self.upload_pool.submit(
+                    self.s3handler.get_s3_link_or_local_path_for_image,
                     element["img"],
                     self.img_file_extension,
                     f"{page_number}_{idx}",
                     "images"
-                )
-                extracted_images.append(str(image_link))
+                ))
 
             if (element["type"] in ["text", "figure"] and
                 self.extraction_type in [
@@ -197,38 +576,81 @@ class OCRProcessor(OCRBase):
             ):
                 if "html" in element.get("res", []):
                     tbl_html_contents = element["res"]["html"]
-                    async with aiofiles.tempfile.NamedTemporaryFile("wb+") as tempf:
-                        await tempf.write(bytes(tbl_html_contents, "utf-8"))
-                        await tempf.seek(0)
-                        excel_parser = ExcelParser(tempf.name)
-                        temp_filepath_output = Path(f"/tmp/excel_{random.randint(100, 10_000)}_tempfile.xlsx")
-                        excel_parser.to_excel(temp_filepath_output)
-                    content_link = self.s3handler.get_s3_link_or_local_path_for_file(
-                        temp_filepath_output,
-                        f"{page_number}_{table_sort_number}",
-                        file_ext="xlsx"
-                    )
-                    image_link = self.s3handler.get_s3_link_or_local_path_for_image(
+                    # Repeated tables (e.g. on every page of a report) are converted and stored once
+                    table_key = hashlib.sha256(tbl_html_contents.encode("utf-8")).hexdigest()
+                    content_link = self.table_cache.get(table_key)
+                    if content_link is None:
+                        content_link = self.upload_pool.submit(
+                            self.store_table,
+                            tbl_html_contents,
+                            f"{page_number}_{table_sort_number}"
+                        )
+                        self.table_cache[table_key] = content_link
+                    image_link = self.upload_pool.submit(
+                        self.s3handler.get_s3_link_or_local_path_for_image,
                         element["img"],
                         self.img_file_extension,
                         f"{page_number}_{table_sort_number}",
                         "tables"
                     )
-                    self.final_combined_results[element["type"]].append({
+                    # The links are filled in by resolve_links once the uploads are done
+                    self.final_combined_results["table"].append({
                         "page_number": page_number,
                         "order": table_sort_number,
                         "content_link": content_link,
-                        "image_link": str(image_link)
+                        "image_link": image_link
                     })
                     table_sort_number += 1
                 else:
-                    logging.warning("Table was detected but contents could not be retrived.")
+                    logger.warning("Table was detected but contents could not be retrived.")
         if extracted_images:
             self.final_combined_results["image"].append({
                 "page_number": page_number,
                 "images": extracted_images
             })
 
+    def store_table(self, tbl_html_contents: str, filename: str):
+        """ Convert the html table to a xlsx file and store it; runs on the upload threads """
+        return self.s3handler.get_s3_link_or_local_path_for_buffer(
+            html_table_to_excel(tbl_html_contents),
+            filename,
+            file_ext="xlsx"
+        )
+
+    async def resolve_links(self):
+        """ Wait for the pending uploads of all the pages and fill in their links """
+        tables = self.final_combined_results["table"]
+        images = self.final_combined_results["image"]
+        pending = {
+            link
+            for table in tables
+            for link in (table["content_link"], table["image_link"])
+        }
+        pending.update(link for page in images for link in page["images"])
+        # The pages processed before were resolved already
+        pending = [link for link in pending if isinstance(link, Future)]
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in pending))
+
+        def resolve(link):
+            return link.result() if isinstance(link, Future) else link
+
+        for table in tables:
+            table["content_link"] = resolve(table["content_link"])
+            table["image_link"] = str(resolve(table["image_link"]))
+        for page in images:
+            page["images"] = [str(resolve(link)) for link in page["images"]]
+
+    async def close(self):
+        """ Release the OCR engine and the upload threads; the processor cannot be used afterwards """
+        await asyncio.to_thread(self.upload_pool.shutdown)
+        release_ocr_engine(self.engine_params, self.ocr_engine)
+        self.ocr_engine = None
+        self.result_cache.clear()
+        self.table_cache = {}
+        gc.collect()
+        if paddle.device.is_compiled_with_cuda():
+            paddle.device.cuda.empty_cache()
+
     async def handler(self) -> dict:
         """ OCR handler for image or pdf file """
         self.final_combined_results = {
@@ -236,13 +658,34 @@ class OCRProcessor(OCRBase):
             "image": [],
             "table": []
         }
+        self.table_cache = {}
 
         if self.is_image:
             image_data = self.read_image()
-            await self.process(image_data)
+            await self.submit_page(image_data)
         else:
-            for page_num, image_data in self.read_pdf_scanned_doc():
-                logging.info("Processing page number %s.", page_num)
-                await self.process(image_data=image_data, page_number=page_num)
+            # Rasterize the next pages in the background while the current one is OCR'd
+            loop = asyncio.get_running_loop()
+            page_queue = asyncio.Queue(maxsize=2)
+            stop_event = threading.Event()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                producer = loop.run_in_executor(
+                    executor, self.produce_pdf_pages, page_queue, loop, stop_event
+                )
+                try:
+                    while (item := await page_queue.get()) is not None:
+                        page_num, image_data = item
+                        logger.info("Processing page number %s.", page_num)
+                        await self.submit_page(image_data=image_data, page_number=page_num)
+                        # Release the page before waiting for the next one
+                        del item, image_data
+                finally:
+                    stop_event.set()
+                    # Make room for a producer blocked on a full queue so it can exit
+                    while not page_queue.empty():
+                        page_queue.get_nowait()
+                    await producer
 
+        # The uploads of a page carry on while the next pages are processed
+        await self.resolve_links()
         return self.final_combined_results
@@ -1,14 +1,111 @@
 import os
 import io
 import logging
+import time
+import tempfile
+import threading
+import functools
+from collections import OrderedDict
 from pathlib import Path, PosixPath
 from typing import Optional, Union
 from PIL import Image
+import cv2
+import numpy as np
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 
-logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Content types of the stored image formats
+IMAGE_CONTENT_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif"
+}
+
+# OpenCV encoder parameters per image format
+ENCODE_PARAMS = {
+    "jpeg": [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+    "png": [cv2.IMWRITE_PNG_COMPRESSION, 1]
+}
+
+def encode_image(
+    image_data: np.ndarray,
+    file_extension: str,
+    png_compression: Optional[int]=None
+) -> bytes:
+    """ Encode the RGB image data in the given format """
+    if file_extension not in ENCODE_PARAMS or image_data.ndim not in (2, 3):
+        # OpenCV has no gif encoder
+        buffer = io.BytesIO()
+        Image.fromarray(image_data).save(buffer, format=file_extension)
+        return buffer.getvalue()
+
+    if image_data.ndim == 3:
+        image_data = cv2.cvtColor(image_data, cv2.COLOR_RGB2BGR)
+    encode_params = ENCODE_PARAMS[file_extension]
+    if file_extension == "png" and png_compression is not None:
+        encode_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    _, encoded = cv2.imencode(f".{file_extension}", image_data, encode_params)
+    return encoded.tobytes()
+
+# Files above the threshold are uploaded in parts, concurrently
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client(aws_region_name: str, signature_version: str="s3v4"):
+    """
+    Returns the s3 client of the region, shared across the storage handlers.
+    boto3 clients are thread safe for method calls, so the upload threads share
+    the client and its connection pool
+    """
+    return boto3.client(
+        "s3",
+        region_name=aws_region_name,
+        config=Config(
+            signature_version=signature_version,
+            s3={"addressing_style": "auto"},
+            max_pool_connections=50
+        )
+    )
+
+# Wait (in seconds) before looking up a bucket region again after a failed lookup
+REGION_RETRY_SECS = 60
+
+# Regions of the buckets looked up so far
+_bucket_regions = {}
+
+def get_bucket_region(bucket_name: str, aws_region_name: str) -> Optional[str]:
+    """
+    Returns the region the bucket lives in, so its uploads / presigned urls go straight
+    to the regional endpoint instead of being redirected there. None when the lookup failed
+    this time (e.g. throttling, no network), so that it is tried again later
+    """
+    if bucket_name not in _bucket_regions:
+        try:
+            location = get_s3_client(aws_region_name).get_bucket_location(Bucket=bucket_name)
+        except ClientError as cexc:
+            if cexc.response.get("Error", {}).get("Code") != "AccessDenied":
+                logger.info("Could not get the bucket region, using %s. %s", aws_region_name, cexc)
+                return None
+            # Not allowed to look it up; the configured region is used from now on
+            logger.info("Not allowed to get the bucket region, using %s.", aws_region_name)
+            _bucket_regions[bucket_name] = aws_region_name
+        except BotoCoreError as exc:
+            logger.info("Could not get the bucket region, using %s. %s", aws_region_name, exc)
+            return None
+        else:
+            # Buckets in us-east-1 have no location constraint
+            _bucket_regions[bucket_name] = location.get("LocationConstraint") or "us-east-1"
+    return _bucket_regions[bucket_name]
 
 class StorageHandler:
     """ Store images / files in the s3 or local disk """
@@ -17,30 +114,79 @@ class StorageHandler:
         use_s3: bool,
         bucket_name: str,
         bucket_key: str,
-        aws_region_name: str
+        aws_region_name: str,
+        png_compression: int=1
     ) -> None:
         self.use_s3 = use_s3
         self.bucket_name = bucket_name
         self.bucket_key = bucket_key
-        self.s3_client = boto3.client(
-            "s3",
-            region_name=aws_region_name,
-            config=Config(
-                signature_version="s3v4",
-                s3={"addressing_style": "path"}
-            )
-        )
+        # zlib level of the stored png images; they are short lived, so speed over size
+        self.png_compression = png_compression
+        # Settings don't change after the init, checked once for all the uploads
+        self.s3_enabled = bool(self.use_s3 and self.bucket_name and self.bucket_key)
+        self.aws_region_name = aws_region_name
+        # Client of the bucket's region, set up on the first upload
+        self.s3_client = None
+        self.s3_client_lock = threading.Lock()
+        # While the region cannot be looked up, the next lookup waits until then
+        self.region_retry_at = 0.0
+        # Local disk directory of the stored files, created on the first local write
+        self.local_files_dir = None
+        self.local_files_dir_lock = threading.Lock()
+        # Presigned urls by bucket key, with the time they expire at
+        self.presigned_urls = OrderedDict()
+        self.presigned_urls_size = 4096
+        # Used from the upload threads
+        self.presigned_urls_lock = threading.Lock()
+
+    def get_local_files_dir(self) -> PosixPath:
+        """ Returns the local disk directory of the handler, creating it on first use """
+        # The files of a page are stored from several threads
+        with self.local_files_dir_lock:
+            if self.local_files_dir is None:
+                local_files_dir = Path(tempfile.mkdtemp(prefix="ocr_files_"))
+                (local_files_dir / "images").mkdir()
+                self.local_files_dir = local_files_dir
+        return self.local_files_dir
+
+    def get_bucket_s3_client(self):
+        """ Returns the s3 client of the bucket's region, looking the region up on first use """
+        if self.s3_client is not None:
+            return self.s3_client
+        # A single upload thread looks the region up, the others wait for it
+        with self.s3_client_lock:
+            if self.s3_client is None:
+                if time.monotonic() < self.region_retry_at:
+                    return get_s3_client(self.aws_region_name)
+                bucket_region = get_bucket_region(self.bucket_name, self.aws_region_name)
+                if bucket_region is None:
+                    # Not looked up again for a while, rather than on every upload of an outage
+                    self.region_retry_at = time.monotonic() + REGION_RETRY_SECS
+                    return get_s3_client(self.aws_region_name)
+                self.s3_client = get_s3_client(bucket_region)
+        return self.s3_client
 
     def generate_presigned_url(
         self,
         bucket_key: str,
-        signed_url_expiry_secs: int=86400
+        signed_url_expiry_secs: int=86400,
+        min_remaining_secs: Optional[int]=None
     ) -> Optional[str]:
         """
-        Generates a presigned url of the file stored in s3
+        Generates a presigned url of the file stored in s3. A previously signed url of
+        the key is reused while it stays valid for at least min_remaining_secs
+        (default: half of the expiry)
         """
+        if min_remaining_secs is None:
+            min_remaining_secs = signed_url_expiry_secs // 2
+        now = time.monotonic()
+        with self.presigned_urls_lock:
+            cached = self.presigned_urls.get(bucket_key)
+        if cached and cached[1] - now >= min_remaining_secs:
+            return cached[0]
+
         try:
-            url = self.s3_client.generate_presigned_url(
+            url = self.get_bucket_s3_client().generate_presigned_url(
                 ClientMethod="get_object",
                 Params={
                     "Bucket": self.bucket_name,
@@ -49,8 +195,14 @@ class StorageHandler:
                 ExpiresIn=signed_url_expiry_secs
             )
         except ClientError as cexc:
-            logging.error("Error while generating presigned url %s", cexc)
+            logger.error("Error while generating presigned url %s", cexc)
             return None
+
+        with self.presigned_urls_lock:
+            self.presigned_urls[bucket_key] = (url, now + signed_url_expiry_secs)
+            self.presigned_urls.move_to_end(bucket_key)
+            if len(self.presigned_urls) > self.presigned_urls_size:
+                self.presigned_urls.popitem(last=False)
         return url
 
     def get_s3_link_or_local_path_for_image(
@@ -61,45 +213,57 @@ class StorageHandler:
         dir_type: str
     ) -> Union[PosixPath, str]:
         """ Store image file in s3 or local disk and returns the path to that file """
-        mapper = {
-            "png": "image/png",
-            "jpg": "image/jpeg",
-            "jpeg": "image/jpeg",
-            "gif": "image/gif"
-        }
-        file_extension = file_extension.group(1) if file_extension else "jpeg"
-        if file_extension == "jpg":
+        if hasattr(file_extension, "group"):
+            file_extension = file_extension.group(1)
+        file_extension = (file_extension or "jpeg").lower().lstrip(".")
+        if file_extension not in IMAGE_CONTENT_TYPES:
+            # jpg, and the formats without a known content type, are stored as jpeg
             file_extension = "jpeg"
-        image_content_type = mapper[file_extension] if file_extension else "image/jpeg"
-
-        img = Image.fromarray(image_data)
-        buffer = io.BytesIO()
+        image_content_type = IMAGE_CONTENT_TYPES[file_extension]
 
-        img.save(buffer, format=file_extension)
-        buffer.seek(0,0)
+        # Encoded once, for either of the storages
+        encoded_image = encode_image(image_data, file_extension, self.png_compression)
 
-        if all([self.use_s3, self.bucket_name, self.bucket_key, self.s3_client]):
+        if self.s3_enabled:
             merged_bucket_key = f"{self.bucket_key}/{dir_type}/{filename}.{file_extension}"
             try:
-                self.s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=merged_bucket_key,
-                    Body=buffer,
-                    ContentType=image_content_type
-                )
-                logging.info("Successfully uploaded the image to s3.")
+                if len(encoded_image) < MULTIPART_THRESHOLD:
+                    self.get_bucket_s3_client().put_object(
+                        Bucket=self.bucket_name,
+                        Key=merged_bucket_key,
+                        Body=encoded_image,
+                        ContentType=image_content_type
+                    )
+                else:
+                    self.get_bucket_s3_client().upload_fileobj(
+                        # Shares the bytes instead of copying them
+                        io.BytesIO(encoded_image),
+                        Bucket=self.bucket_name,
+                        Key=merged_bucket_key,
+                        ExtraArgs={"ContentType": image_content_type},
+                        Config=TRANSFER_CONFIG
+                    )
+                logger.info("Successfully uploaded the image to s3.")
             except ClientError as cexc:
-                logging.info("Error while uploading the image. %s", str(cexc))
+                logger.info("Error while uploading the image. %s", cexc)
                 return None
             generated_url = self.generate_presigned_url(bucket_key=merged_bucket_key)
             return generated_url
 
-        fpath = Path("/tmp/images")
-        os.makedirs(fpath, exist_ok=True)
-        img_fpath = fpath / f"{filename}.{file_extension}"
-        img = Image.fromarray(image_data)
-        img.save(img_fpath)
-        return img_fpath
+        # Unique name, so documents processed one after another don't overwrite each other;
+        # the path is only handed out once the image is completely written
+        fd, img_fpath = tempfile.mkstemp(
+            prefix=f"{filename}_",
+            suffix=f".{file_extension}",
+            dir=self.get_local_files_dir() / "images"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(encoded_image)
+        except Exception:
+            os.unlink(img_fpath)
+            raise
+        return Path(img_fpath)
 
     def get_s3_link_or_local_path_for_file(
         self,
@@ -109,21 +273,58 @@ class StorageHandler:
         content_type: str="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     ):
         """ Store excel file in s3 or local disk and returns the path to that file """
-        if all([self.use_s3, self.bucket_name, self.bucket_key, self.s3_client]):
+        if self.s3_enabled:
             merged_bucket_key = f"{self.bucket_key}/{filename}.{file_ext}"
             try:
-                self.s3_client.upload_file(
+                self.get_bucket_s3_client().upload_file(
                     src_filename,
                     Bucket=self.bucket_name,
                     Key=merged_bucket_key,
-                    ExtraArgs={"ContentType": content_type}
+                    ExtraArgs={"ContentType": content_type},
+                    Config=TRANSFER_CONFIG
                 )
-                logging.info("Successfully uploaded the excel file to s3.")
+                logger.info("Successfully uploaded the excel file to s3.")
             except ClientError as cexc:
-                logging.info("Error while uploading the image. %s", str(cexc))
+                logger.info("Error while uploading the image. %s", cexc)
                 return None
             generated_url = self.generate_presigned_url(bucket_key=merged_bucket_key)
             return generated_url
 
-        logging.info("Not enough info for S3 storage. Using the local disk.")
+        logger.info("Not enough info for S3 storage. Using the local disk.")
         return src_filename
+
+    def get_s3_link_or_local_path_for_buffer(
+        self,
+        buffer: io.BytesIO,
+        filename: str,
+        file_ext: str="xlsx",
+        content_type: str="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ) -> Union[PosixPath, str]:
+        """ Store in-memory file contents in s3 or local disk and returns the path to that file """
+        if self.s3_enabled:
+            merged_bucket_key = f"{self.bucket_key}/{filename}.{file_ext}"
+            try:
+                self.get_bucket_s3_client().upload_fileobj(
+                    buffer,
+                    Bucket=self.bucket_name,
+                    Key=merged_bucket_key,
+                    ExtraArgs={"ContentType": content_type},
+                    Config=TRANSFER_CONFIG
+                )
+                logger.info("Successfully uploaded the %s file to s3.", file_ext)
+            except ClientError as cexc:
+                logger.info("Error while uploading the file. %s", cexc)
+                return None
+            generated_url = self.generate_presigned_url(bucket_key=merged_bucket_key)
+            return generated_url
+
+        logger.info("Not enough info for S3 storage. Using the local disk.")
+        # Unique name, so documents processed one after another don't overwrite each other
+        fd, file_fpath = tempfile.mkstemp(
+            prefix=f"{filename}_",
+            suffix=f".{file_ext}",
+            dir=self.get_local_files_dir()
+        )
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer.getbuffer())
+        return Path(file_fpath)
@@ -1,29 +1,80 @@
 import os
+import io
+import fcntl
+import shutil
 import tarfile
+import tempfile
+import functools
+import re
 import logging
+import urllib.request
 from pathlib import Path, PosixPath
-from ocr_extractor.wget import download
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import lxml.html
+from openpyxl import Workbook
 
-logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
 
-def get_ocr_models(base_path: PosixPath):
-    """ Get OCR models"""
+# INT8 (PaddleSlim quantized) english recognizer
+QUANTIZED_REC_MODEL_URL = "https://paddleocr.bj.bcebos.com/PP-OCRv3/english/en_PP-OCRv3_rec_slim_infer.tar"
+
+# Upper bound of the row / column span of a table cell, against runaway spans
+MAX_CELL_SPAN = 1000
+
+# Max wait (in seconds) for the model server to connect / send data
+DOWNLOAD_TIMEOUT_SECS = 60
+
+def get_model_dir(url: str, base_path: PosixPath) -> PosixPath:
+    """ Directory the model tar file of the url extracts to """
+    return base_path / os.path.basename(url)[:-len(".tar")]
+
+def is_model_ready(model_dir: PosixPath, trust_existing: bool=False) -> bool:
+    """
+    Whether the directory holds a completely extracted model. Models are moved in place
+    together with their sentinel once extracted; trust_existing also accepts the model
+    directories put in place otherwise, e.g. baked into an image or mounted
+    """
+    if (model_dir / ".ready").exists():
+        return True
+    return trust_existing and (model_dir / "inference.pdmodel").exists() and (
+        model_dir / "inference.pdiparams"
+    ).exists()
+
+def download_model(url: str, base_path: PosixPath):
+    """ Stream the model tar file from the url straight into the extraction """
+    logger.info("Downloading the model %s", url)
+    model_dir = get_model_dir(url, base_path)
+    # Extracted aside, so an interrupted download never leaves a partial model in place
+    extract_dir = Path(tempfile.mkdtemp(prefix=".extract_", dir=base_path))
+    try:
+        # A stalled connection fails instead of holding the download lock of every worker
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT_SECS) as response:
+            with tarfile.open(fileobj=response, mode="r|") as tar:
+                tar.extractall(extract_dir)
+        extracted_dir = extract_dir / model_dir.name
+        if not extracted_dir.is_dir():
+            raise FileNotFoundError(f"The model {url} did not extract to the directory {model_dir.name}")
+        (extracted_dir / ".ready").touch()
+        # Leftovers of a partial extraction without the sentinel
+        shutil.rmtree(model_dir, ignore_errors=True)
+        os.replace(extracted_dir, model_dir)
+    finally:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+@functools.lru_cache(maxsize=None)
+def get_ocr_models(base_path: PosixPath, quantized: bool=False, trust_existing: bool=False):
+    """
+    Get OCR models; quantized swaps in the INT8 recognizer. trust_existing uses the model
+    directories found in base_path (e.g. baked into an image) instead of downloading them.
+    The model paths are looked up once per process; the returned dict is shared, don't modify it
+    """
     model_urls = [
         "https://paddleocr.bj.bcebos.com/PP-OCRv3/english/en_PP-OCRv3_det_infer.tar",
         "https://paddleocr.bj.bcebos.com/PP-OCRv4/english/en_PP-OCRv4_rec_infer.tar",
         "https://paddleocr.bj.bcebos.com/dygraph_v2.0/ch/ch_ppocr_mobile_v2.0_cls_infer.tar",
         "https://paddleocr.bj.bcebos.com/ppstructure/models/slanet/en_ppstructure_mobile_v2.0_SLANet_infer.tar",
-        "https://paddleocr.bj.bcebos.com/ppstructure/models/layout/picodet_lcnet_x1_0_fgd_layout_infer.tar",
-        "https://paddle-model-ecology.bj.bcebos.com/model/layout-parser/ppyolov2_r50vd_dcn_365e_publaynet.tar"
-    ]
-
-    tar_files = [
-        "en_PP-OCRv3_det_infer.tar",
-        "en_PP-OCRv4_rec_infer.tar",
-        "ch_ppocr_mobile_v2.0_cls_infer.tar",
-        "en_ppstructure_mobile_v2.0_SLANet_infer.tar",
-        "picodet_lcnet_x1_0_fgd_layout_infer.tar",
-        "ppyolov2_r50vd_dcn_365e_publaynet.tar"
+        "https://paddleocr.bj.bcebos.com/ppstructure/models/layout/picodet_lcnet_x1_0_fgd_layout_infer.tar"
     ]
 
     file_paths = {
@@ -34,18 +85,79 @@ def get_ocr_models(base_path: PosixPath):
         "layout_model_dir": base_path / "picodet_lcnet_x1_0_fgd_layout_infer"
     }
 
-    if not os.path.exists(base_path):
-        os.makedirs(base_path)
+    if quantized:
+        model_urls[1] = QUANTIZED_REC_MODEL_URL
+        file_paths["rec_model_dir"] = base_path / "en_PP-OCRv3_rec_slim_infer"
 
-        for url in model_urls:
-            logging.info("Downloading the model %s", url)
-            download(url=url, out=str(base_path))
+    def missing_models():
+        return [
+            url for url in model_urls
+            if not is_model_ready(get_model_dir(url, base_path), trust_existing)
+        ]
 
-        for tar_file in tar_files:
-            with tarfile.open(base_path / tar_file) as tar:
-                tar.extractall(base_path)
+    if missing_models():
+        try:
+            os.makedirs(base_path, exist_ok=True)
+            lock_file = open(base_path / ".download.lock", "w")
+        except OSError:
+            logger.error("OCR models are missing and %s is not writable.", base_path)
+            raise
+        # Workers starting together wait for the first one to download the models
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                missing_urls = missing_models()
+                if missing_urls:
+                    with ThreadPoolExecutor(max_workers=len(missing_urls)) as executor:
+                        downloads = [
+                            executor.submit(download_model, url, base_path) for url in missing_urls
+                        ]
+                        for future in downloads:
+                            future.result()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
     else:
-        logging.info("OCR models path exist.")
+        logger.info("OCR models path exist.")
+
     return {
         k: str(v) for k, v in file_paths.items()
     }
+
+def parse_span(value: Optional[str]) -> int:
+    """ Row / column span of a table cell; the html is model generated, so malformed values read as 1 """
+    match = re.match(r"\s*(\d+)", value or "")
+    if not match:
+        return 1
+    return min(max(int(match.group(1)), 1), MAX_CELL_SPAN)
+
+def html_table_to_excel(html: str) -> io.BytesIO:
+    """ Convert an html table to an in-memory xlsx workbook, keeping the merged cells """
+    workbook = Workbook()
+    sheet = workbook.active
+    # Cells already covered by a rowspan / colspan of a previous cell
+    occupied = set()
+
+    for row_idx, row in enumerate(lxml.html.fromstring(html).iter("tr"), start=1):
+        col_idx = 1
+        for cell in row.iter("td", "th"):
+            while (row_idx, col_idx) in occupied:
+                col_idx += 1
+            rowspan = parse_span(cell.get("rowspan"))
+            colspan = parse_span(cell.get("colspan"))
+            sheet.cell(row=row_idx, column=col_idx, value=cell.text_content().strip())
+            if rowspan > 1 or colspan > 1:
+                sheet.merge_cells(
+                    start_row=row_idx,
+                    start_column=col_idx,
+                    end_row=row_idx + rowspan - 1,
+                    end_column=col_idx + colspan - 1
+                )
+            for r in range(row_idx, row_idx + rowspan):
+                for c in range(col_idx, col_idx + colspan):
+                    occupied.add((r, c))
+            col_idx += colspan
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer